@@ -1,4 +1,7 @@
 import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 import os
@@ -7,13 +10,13 @@ from citegraph.draw import DotGraphRenderer, GephiGraphRenderer, StylingInfo, SU
 from citegraph.explore import Params
 from citegraph.explore import smart_fetch as create_graph
 from citegraph.model import Biblio
-from citegraph.semapi import PaperDb
 
 DEFAULT_FORMAT = "pdf"
 DB_LOC_VAR = "CITEGRAPH_DB"
 
 
-def parse_args():
+@lru_cache(maxsize=1)
+def build_parser():
     parser = argparse.ArgumentParser(
         prog="citegraph",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -49,8 +52,9 @@ def parse_args():
     """.rstrip())
 
     parser.add_argument("-f", "--format", nargs="+", metavar="FORMAT", default=[DEFAULT_FORMAT],
+                        choices=SUPPORTED_FORMATS,
                         help=f"Render format(s), default is '{DEFAULT_FORMAT}'. "
-                             f"Must be one of {SUPPORTED_FORMATS}.")
+                             f"Must be one of {', '.join(SUPPORTED_FORMATS)}.")
     parser.add_argument("-o", "--outfile", metavar="FILE", default="graph",
                         help="Path to the rendered file, without extension."
                              " The extension is determined based on the render format.")
@@ -70,15 +74,16 @@ def parse_args():
                         help="Paper IDs for the starting points of the graph exploration")
 
     parser.add_argument("--also-up", help="Specifies that backwards links will also be explored", action="store_true")
+    parser.add_argument("--reduce", help="Apply a transitive reduction to the graph before rendering, "
+                                         "which removes edges that are implied by a longer path",
+                        action="store_true")
 
-    parsed = parser.parse_args()
+    return parser
 
-    unknown_formats = set(parsed.format) - set(SUPPORTED_FORMATS)
-    if len(unknown_formats) != 0:
-        parser.error(f"Unrecognized format(s) {unknown_formats}")
 
-    if len(parsed.format) == 0:
-        parsed.format = [DEFAULT_FORMAT]
+def parse_args():
+    parser = build_parser()
+    parsed = parser.parse_args()
 
     if len(parsed.graph_roots) == 0 and not parsed.bibfile:
         parser.error("You must specify the ID of a paper, or a bibtex file that contains such IDs")
@@ -91,24 +96,27 @@ def parse_args():
 
 
 def seeds_in_bib(biblio: Biblio):
-    seeds = []
     for paper in biblio:
         if paper.paperId:
-            seeds.append(paper.paperId)
+            yield paper.paperId
         elif paper.journal and paper.journal.lower() == "arxiv":
             volume: str = getattr(paper, "volume", "")
             if volume.startswith("abs/"):
-                seeds.append("arXiv:" + volume[len("abs/"):])
-
-    return seeds
+                yield "arXiv:" + volume[len("abs/"):]
 
 
 
 def main(args, do_error):
-    bibdata = Biblio.from_file(args.bibfile) if args.bibfile else Biblio.empty()
+    # deferred import: pulls in semanticscholar + requests, which are
+    # not needed for --help or argument errors
+    from citegraph.semapi import PaperDb
+
+    bibdata = Biblio.from_file_cached(args.bibfile) if args.bibfile else Biblio.empty()
 
-    # Complete the given seeds with seeds from the bibtex file
-    seeds = {*args.graph_roots, *seeds_in_bib(bibdata)}
+    # Complete the given seeds with seeds from the bibtex file.
+    # dict.fromkeys dedups with a single hash per id and keeps
+    # insertion order, so exploration order is reproducible.
+    seeds = list(dict.fromkeys(itertools.chain(args.graph_roots, seeds_in_bib(bibdata))))
 
     if len(seeds) == 0:
         do_error("No graph roots could be found, mention some on the command-line")
@@ -119,21 +127,39 @@ def main(args, do_error):
         params = Params(max_graph_size=args.size, consider_upward_links=args.also_up)
         graph = create_graph(seeds=seeds, biblio=bibdata, params=params, db=db)
 
-    renderer = None
-    for f in args.format:
+    if args.reduce:
+        graph.transitive_reduction()
+
+    # Draw the graph once per renderer kind, then render each format.
+    # Rendering forks a graphviz process per format, so doing them in
+    # parallel costs only the slowest format instead of their sum.
+    # dedupe: argparse accepts "-f pdf pdf", and two jobs for the same
+    # format would write the same output file concurrently
+    renderers = {}
+    jobs = []
+    for f in dict.fromkeys(args.format):
         if f in DotGraphRenderer.supported_formats():
-            if not isinstance(renderer, DotGraphRenderer):
-                renderer = DotGraphRenderer(bibdata=bibdata, styling=StylingInfo(args.tags))
+            renderer = renderers.get(DotGraphRenderer)
+            if not renderer:
+                renderer = renderers[DotGraphRenderer] = DotGraphRenderer(bibdata=bibdata, styling=StylingInfo(args.tags))
+                graph.draw(renderer)
         elif f in GephiGraphRenderer.supported_formats():
-            if not isinstance(renderer, GephiGraphRenderer):
-                renderer = GephiGraphRenderer()
+            renderer = renderers.get(GephiGraphRenderer)
+            if not renderer:
+                renderer = renderers[GephiGraphRenderer] = GephiGraphRenderer()
+                graph.draw(renderer)
         else:
             raise AssertionError(f"Wrong format {args.format}")
 
-        graph.draw(renderer)
-        print("Rendering...")
-        renderer.render(filename=args.outfile, render_format=f)
-        print("Rendered to " + args.outfile + "." + f)
+        jobs.append((renderer, f))
+
+    print("Rendering...")
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [pool.submit(renderer.render, filename=args.outfile, render_format=f)
+                   for (renderer, f) in jobs]
+        for ((_, f), future) in zip(jobs, futures):
+            future.result()
+            print("Rendered to " + args.outfile + "." + f)
 
 
 
@@ -1,16 +1,51 @@
-import html
-import textwrap
+import io
+import shutil
 from abc import abstractmethod
 from typing import Dict
-from xml.sax.saxutils import escape as xml_escape
 
 import graphviz as g
-import yaml
 
 from citegraph.model import Biblio, Paper, Person, PaperAndRefs, PaperId
 
 UNKNOWN_PERSON = Person(string="Unknown von Unknown")
 
+def _wrap_title(title: str, width=20):
+    """
+    Wraps the title at the given width. Much simpler than
+    textwrap.wrap (no hyphenation or em-dash handling), which
+    shows up in profiles when labelling thousands of nodes.
+    """
+    lines = []
+    cur = ""
+    for word in title.split():
+        if cur and len(cur) + 1 + len(word) > width:
+            lines.append(cur)
+            cur = word
+        else:
+            cur = cur + " " + word if cur else word
+    if cur:
+        lines.append(cur)
+    return lines
+
+# Edge styles, by whether both endpoints are in the bib file
+_EDGE_ATTRS = {True: {"weight": "2"}, False: {"color": "gray"}}
+
+# One-pass escapes: html.escape/xml.sax escape do a str.replace pass
+# per special character, str.translate scans the string once in C.
+# The XML table also covers quotes, since gexf attributes are quoted.
+_HTML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;",
+                              '"': "&quot;", "'": "&#x27;"})
+_XML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;",
+                             '"': "&quot;", "'": "&apos;"})
+
+
+def _html_escape(s: str) -> str:
+    return s.translate(_HTML_ESCAPE)
+
+
+def _xml_escape(s: str) -> str:
+    return s.translate(_XML_ESCAPE)
+
 
 class GraphRenderer(object):
     """Renders a graph somewhere."""
@@ -37,37 +72,137 @@ class Graph(object):
     def __init__(self, nodes: Dict[PaperId, PaperAndRefs]):
         self.nodes = nodes
 
-        # successors[p1.id][p2.id] means there is a directed edge p1 -> p2
-        self.successors = {}
-
-        for paper in self.nodes.values():
-            succs = set([])
-            self.successors[paper.id] = succs
-
-            for (ref, influential) in paper.references:
-                if ref.id in self.nodes:
-                    succs.add(ref)
+        # p2 in successors[p1.id] means there is a directed edge p1 -> p2
+        self.successors = {
+            paper.id: {ref for (ref, _) in paper.references if ref.id in nodes}
+            for paper in nodes.values()
+        }
 
-    # todo transitive reduction
+    def transitive_reduction(self):
+        """
+        Removes edges that are implied by a longer path, e.g. drop
+        a -> c if a -> b -> c is also in the graph. This can
+        drastically cut the number of edges handed to graphviz, whose
+        layout cost grows with edge count, without losing reachability
+        information.
+
+        Citation data does contain cycles (papers citing each other),
+        where dropping "implied" edges naively can disconnect nodes:
+        two cycle members each justify removing the other's edge to a
+        common target. So the reduction works on the condensation of
+        the graph: edges inside a strongly connected component are
+        always kept, and only edges between distinct components may be
+        dropped, which is sound because the condensation is a DAG.
+        """
+        id_succs = {pid: {p.id for p in ps} for (pid, ps) in self.successors.items()}
+
+        # Kosaraju: one DFS pass for finish order, one over the
+        # reversed graph to label components (by a representative id)
+        order = []
+        seen = set()
+        for root in id_succs:
+            if root in seen:
+                continue
+            seen.add(root)
+            stack = [(root, iter(id_succs[root]))]
+            while stack:
+                (node, succs) = stack[-1]
+                for m in succs:
+                    if m not in seen:
+                        seen.add(m)
+                        stack.append((m, iter(id_succs[m])))
+                        break
+                else:
+                    order.append(node)
+                    stack.pop()
+
+        preds = {pid: [] for pid in id_succs}
+        for (pid, succs) in id_succs.items():
+            for m in succs:
+                preds[m].append(pid)
+
+        scc = {}
+        for root in reversed(order):
+            if root in scc:
+                continue
+            scc[root] = root
+            stack = [root]
+            while stack:
+                for m in preds[stack.pop()]:
+                    if m not in scc:
+                        scc[m] = root
+                        stack.append(m)
+
+        comp_succs = {}
+        for (pid, succs) in id_succs.items():
+            c = scc[pid]
+            bucket = comp_succs.setdefault(c, set())
+            for m in succs:
+                if scc[m] != c:
+                    bucket.add(scc[m])
+
+        def descendants(start):
+            dseen = set()
+            stack = [start]
+            while stack:
+                for m in comp_succs[stack.pop()]:
+                    if m not in dseen:
+                        dseen.add(m)
+                        stack.append(m)
+            return dseen
+
+        desc = {c: descendants(c) for c in comp_succs}
+
+        for (u, direct) in self.successors.items():
+            cu = scc[u]
+            witness_comps = {scc[p.id] for p in direct} - {cu}
+            self.successors[u] = {
+                p for p in direct
+                if scc[p.id] == cu
+                or not any(scc[p.id] in desc[w]
+                           for w in witness_comps if w != scc[p.id])
+            }
+        return self
 
     def draw(self, builder: GraphRenderer):
-        for paper in sorted(self.nodes.values(), key=lambda p: p.id):
+        # sort the ids, not the papers: no lambda dispatch per comparison
+        nodes = self.nodes
+        for pid in sorted(nodes):
+            paper = nodes[pid]
             builder.add_node(paper)
-            for ref in self.successors[paper.id]:
+            for ref in self.successors[pid]:
                 builder.add_edge(paper, ref)
 
 
+# compiled selector expressions, keyed by source: tags often share
+# selectors (or the "False" default), no point compiling them twice
+_SELECTOR_CODE = {}
+
+
+def _compile_selector(src: str):
+    code = _SELECTOR_CODE.get(src)
+    if code is None:
+        code = _SELECTOR_CODE[src] = compile(src, f"<selector {src!r}>", "eval")
+    return code
+
+
 class StylingInfo(object):
     """Parses the yaml --tags file, to add attributes to nodes."""
 
     def __init__(self, filename):
         self._by_id = {}
         self._tags = {}
+        self._attr_cache = {}
         self.selectors_by_tag = {}
 
         if filename:
+            import yaml  # deferred, only needed when --tags is given
+            try:
+                from yaml import CSafeLoader as YamlLoader  # libyaml, much faster
+            except ImportError:
+                from yaml import SafeLoader as YamlLoader
             with open(filename) as file:
-                doc = yaml.load(file)
+                doc = yaml.load(file, Loader=YamlLoader)
                 self.categorize(doc)
 
     def add_tag(self, name, attrs, selector_fun):
@@ -91,33 +226,78 @@ class StylingInfo(object):
 
 
             def selects(members, selector):
-                return lambda p, biblio: p.bibtex_id in members\
-                       or eval(selector, {"paper": p})
+                # compile once: eval on a source string would re-parse
+                # the selector for every single node. The eval
+                # environment is reused across calls, only rebinding
+                # 'paper'. Builtins stay visible, selectors
+                # legitimately use any()/all() etc (see README).
+                code = _compile_selector(selector)
+                env = {"paper": None}
+                members = frozenset(members)
+
+                def select(p, biblio):
+                    if p.bibtex_id in members:
+                        return True
+                    env["paper"] = p
+                    return eval(code, env)
+
+                return select
 
 
             self.add_tag(tag, attrs, selector_fun=selects(body.get("members", []), body.get("selector", "False")))
 
 
     def get_attributes(self, paper: Paper, biblio: Biblio):
+        # memoized: rendering several formats queries the same papers
+        cached = self._attr_cache.get(paper.id, None)
+        if cached is not None:
+            return cached
+
         attrs = {}
+        tags = self._tags
 
         for tag, selector in self.selectors_by_tag.items():
             if selector(paper, biblio):
-                attrs.update(self._tags[tag])
+                attrs.update(tags[tag])
 
         attrs.update(self._by_id.get(paper.bibtex_id, {}))
 
+        self._attr_cache[paper.id] = attrs
         return attrs
 
 
 
+def _quote_attr(value: str) -> str:
+    """Quote an attribute value for DOT output. HTML-like labels
+    (delimited by angle brackets) must not be quoted."""
+    if value.startswith("<") and value.endswith(">"):
+        return value
+    return '"' + value.replace('"', '\\"') + '"'
+
+
+def _fmt_attrs(attrs: Dict[str, str]) -> str:
+    return " ".join(f"{k}={_quote_attr(v)}" for (k, v) in attrs.items())
+
+
+# the fully formatted edge attr suffixes, they are constant
+_EDGE_SUFFIX = {in_bib: f" [{_fmt_attrs(attrs)}]"
+                for (in_bib, attrs) in _EDGE_ATTRS.items()}
+
+
 class DotGraphRenderer(GraphRenderer):
+    """
+    Writes DOT syntax directly instead of going through a
+    graphviz.Digraph, which keeps every node and edge as an object
+    and re-serializes all of them on render.
+    """
 
     def __init__(self,
                  bibdata: Biblio,
                  styling: StylingInfo,
                  title="Citation graph"):
-        self.dot = g.Digraph(title, graph_attr={"concentrate": "false"})
+        self._lines = [f'digraph "{title}" {{',
+                       '\tgraph [concentrate=false]']
+        self._cached_source = None
         self.bibdata = bibdata
         self.styling = styling
 
@@ -134,62 +314,72 @@ class DotGraphRenderer(GraphRenderer):
 
 
     def add_node(self, paper: Paper):
-
-        self.dot.node(name=paper.id,
-                      label=DotGraphRenderer.make_label(paper),
-                      **self.get_node_attributes(paper))
+        attrs = {"label": DotGraphRenderer.make_label(paper),
+                 **self.get_node_attributes(paper)}
+        self._lines.append(f'\t"{paper.id}" [{_fmt_attrs(attrs)}]')
+        self._cached_source = None
 
 
     def get_edge_attributes(self, src: Paper, dst: Paper):
-        attrs = {}
-
-        src_in_bib = src in self.bibdata
-        dst_in_bib = dst in self.bibdata
         # if src_in_bib ^ dst_in_bib:
         #     attrs["color"] = "black;0.25:gray" if src_in_bib else "gray;0.75:black"
         # elif
-        if not src_in_bib or not dst_in_bib:
-            attrs["color"] = "gray"
-        else:
-            attrs["weight"] = "2"
-
-        return attrs
+        return _EDGE_ATTRS[src in self.bibdata and dst in self.bibdata]
 
 
     def add_edge(self, src: Paper, dst: Paper):
-        self.dot.edge(src.id, dst.id, **self.get_edge_attributes(src, dst))
+        suffix = _EDGE_SUFFIX[src in self.bibdata and dst in self.bibdata]
+        self._lines.append(f'\t"{src.id}" -> "{dst.id}"{suffix}')
+        self._cached_source = None
+
+
+    @property
+    def source(self) -> str:
+        # cached, so that rendering several formats serializes once
+        if self._cached_source is None:
+            self._cached_source = "\n".join(self._lines) + "\n}\n"
+        return self._cached_source
 
 
     def render(self, filename, render_format):
         if render_format == "dot":
-            self.dot.save(filename=filename + ".dot")
+            with open(filename + ".dot", mode="w", encoding="utf-8") as f:
+                f.write(self.source)
         else:
-            self.dot.render(filename=filename, format=render_format, cleanup=True)
+            # pipe() streams the source to dot's stdin, render() would
+            # first write a source file and have dot read it back
+            data = g.Source(self.source).pipe(format=render_format)
+            with open(filename + "." + render_format, mode="wb") as f:
+                f.write(data)
 
 
     @staticmethod
     def make_label(paper: Paper):
+        # cached on the paper, labels are stable across renders
+        label = paper._dot_label
+        if label is None:
+            first_author: Person = next(iter(paper.authors), UNKNOWN_PERSON)
 
-        first_author: Person = next(iter(paper.authors), UNKNOWN_PERSON)
-
-        label = "<<B>%s" % html.escape(first_author.last_names[0])
-        if paper.year:
-            label += " (%s)" % paper.year
-
-        title = "\n".join(textwrap.wrap(paper.title, width=20))
-
-        label += "</B><BR/>" + html.escape(title).replace("\n", "<BR/>") + ">"
+            author = _html_escape(first_author.last_names[0])
+            year = " (%s)" % paper.year if paper.year else ""
+            title = "<BR/>".join(map(_html_escape, _wrap_title(paper.title)))
 
+            label = paper._dot_label = f"<<B>{author}{year}</B><BR/>{title}>"
         return label
 
 
 class GephiGraphRenderer(GraphRenderer):
+    """
+    Streams nodes and edges into two spill-free buffers as they are
+    added, instead of keeping one formatted string per element and
+    joining them all at render time.
+    """
 
     def __init__(self):
-        self.nodes = []
-        self.edges = []
+        self._nodes = io.StringIO()
+        self._edges = io.StringIO()
+        self._num_edges = 0
 
-    # TODO XML escaping
 
     @classmethod
     def supported_formats(cls):
@@ -197,44 +387,44 @@ class GephiGraphRenderer(GraphRenderer):
 
 
     def add_node(self, paper: Paper):
-        self.nodes.append(
-            f"<node id='{paper.id}' label='{xml_escape(self.make_label(paper))}' />"
+        self._nodes.write(
+            f"            <node id='{paper.id}' label='{_xml_escape(self.make_label(paper))}' />\n"
         )
 
 
     def make_label(self, paper: Paper):
-        first_author: Person = next(iter(paper.authors), UNKNOWN_PERSON)
+        label = paper._gexf_label
+        if label is None:
+            first_author: Person = next(iter(paper.authors), UNKNOWN_PERSON)
 
-        return f"{first_author.last_names[0]} ({paper.year}) {paper.title}"
+            label = paper._gexf_label = f"{first_author.last_names[0]} ({paper.year}) {paper.title}"
+        return label
 
 
     def add_edge(self, src: Paper, dst: Paper):
-        self.edges.append(
-            f"<edge id='{len(self.edges)}' source='{src.id}' target='{dst.id}' />"
+        self._edges.write(
+            f"            <edge id='{self._num_edges}' source='{src.id}' target='{dst.id}' />\n"
         )
+        self._num_edges += 1
 
 
     def render(self, filename, render_format):
         assert render_format in ["gexf", "gephi"], f"Unsupported format {render_format}"
 
         with open(filename + ".gexf", mode="w") as f:
-            f.write("""
-<?xml version="1.0" encoding="UTF-8"?>
-<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">
-    <graph mode="static" defaultedgetype="directed">
-        <nodes>
-            {nodes}
-        </nodes>
-        <edges>
-            {edges}
-        </edges>
-    </graph>
-</gexf>
-""".strip()
-   .format_map({
-                "nodes": ("\n" + ' ' * 4 * 3).join(self.nodes),
-                "edges": ("\n" + ' ' * 4 * 3).join(self.edges)
-            }))
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n'
+                    '    <graph mode="static" defaultedgetype="directed">\n'
+                    '        <nodes>\n')
+            self._nodes.seek(0)
+            shutil.copyfileobj(self._nodes, f)
+            f.write('        </nodes>\n'
+                    '        <edges>\n')
+            self._edges.seek(0)
+            shutil.copyfileobj(self._edges, f)
+            f.write('        </edges>\n'
+                    '    </graph>\n'
+                    '</gexf>\n')
 
 
 SUPPORTED_FORMATS = [*DotGraphRenderer.supported_formats(),
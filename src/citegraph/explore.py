@@ -1,8 +1,13 @@
-from typing import Optional, NamedTuple, Set
+import heapq
+import math
+
+from typing import Optional, NamedTuple, Set, TYPE_CHECKING
 
 from citegraph.draw import Graph
-from citegraph.model import Biblio, Paper, PaperId
-from citegraph.semapi import PaperDb, PaperAndRefs
+from citegraph.model import Biblio, Paper, PaperId, PaperAndRefs
+
+if TYPE_CHECKING:
+    from citegraph.semapi import PaperDb
 
 
 class Params(NamedTuple):
@@ -83,7 +88,7 @@ class Params(NamedTuple):
 
 
 
-Infty = 2 ** 1000
+Infty = math.inf
 
 
 def authors_in_common(p1: Paper, p2: Paper) -> int:
@@ -98,7 +103,12 @@ def authors_similarity(p1: Paper, p2: Paper) -> float:
 
 
 def author_set(p1):
-    return {" ".join(p.last_names) for p in p1.authors}
+    # cached on the paper: edge_disinterest rebuilds the same sets
+    # once per incident edge otherwise
+    s = p1._author_set
+    if s is None:
+        s = p1._author_set = frozenset(" ".join(p.last_names) for p in p1.authors)
+    return s
 
 
 def clusterness(neighbors_in_graph, neighbors):
@@ -109,24 +119,23 @@ def clusterness(neighbors_in_graph, neighbors):
     if total_possible_triplets == 0:
         return 0.75
 
+    # Summing |S & N(v)| over v in S counts every closed triplet
+    # twice (the neighbors multimap is symmetric). The intersections
+    # run in C, instead of a quadratic pairwise python loop.
+    closed_twice = 0
+    for v in neighbors_in_graph:
+        neighbors_of_v = neighbors.get(v, None)
+        if neighbors_of_v:
+            closed_twice += len(neighbors_in_graph & neighbors_of_v)
 
-    def are_neighbors(src: PaperId, dst: PaperId):
-        return dst in neighbors[src] if src in neighbors else False
-
-
-    closed_triplets = sum(1
-                          for (i, nid) in enumerate(neighbors_in_graph)
-                          for (j, mid) in enumerate(neighbors_in_graph)
-                          if i < j and are_neighbors(nid, mid))
-
-    return closed_triplets / total_possible_triplets
+    return closed_twice / 2 / total_possible_triplets
 
 
 
 def smart_fetch(seeds: Set[PaperId],
                 biblio: Biblio,
                 params: Params,
-                db: PaperDb) -> Graph:
+                db: 'PaperDb') -> Graph:
     """
     Builds the graph by fetching reference data from semapi.
 
@@ -134,20 +143,60 @@ def smart_fetch(seeds: Set[PaperId],
 
     assert len(seeds) > 0
 
+    # bound once, read on every score
+    api_weight = params.api_weight
+    distance_penalty = params.distance_penalty
+    clustering_factor = params.clustering_factor
+    degree_cut = params.degree_cut
+
     nodes = {}
     neighbors = {}  # merged successors + predecessors
-    influential_edges = set([])
+    # influential edges indexed by endpoint: scoring only ever asks
+    # about the edges incident to one node, so a flat edge set would
+    # make every score linear in the total number of influential edges
+    influential_in = {}  # dst -> srcs
+    influential_out = {}  # src -> dsts
+    # Cached DOI per candidate id. The DOI of a node only changes when
+    # its neighborhood, distance, or the graph around it does; entries
+    # are evicted at each mutation site instead of recomputing every
+    # candidate on every pick.
+    doi_cache = {}
+    # Max-heap over candidates (lazy deletion): entries are
+    # (-doi, rank, id), and an entry is stale when its doi no longer
+    # matches the cache. The rank is the insertion rank of the node,
+    # so that ties resolve like a first-max scan over 'nodes' did.
+    doi_heap = []
+    node_rank = {}
+    next_rank = 0
+    # ids whose cached DOI was invalidated (or never computed), to be
+    # rescored and pushed before the next pick
+    dirty = set()
+
+
+    def invalidate(nid):
+        doi_cache.pop(nid, None)
+        dirty.add(nid)
+
+
+    def discover(p):
+        nonlocal next_rank
+        if p.id not in nodes:
+            node_rank[p.id] = next_rank
+            next_rank += 1
+        nodes[p.id] = p
+        dirty.add(p.id)
 
     request_failures = 0
-    failed_ids = set([])
+    # ids that are done, either picked into the graph or failed;
+    # either way they are no longer candidates
+    closed_ids = set()
 
 
     def handle_api_failure(id: PaperId, p: Optional[Paper]):
         nonlocal request_failures
         print("[ERROR] Scholar doesn't know paper with id %s (%s)" % (id, p and p.title or "unknown title"))
-        if id in nodes:  # may not be here if the ID is a root
-            del nodes[id]
-        failed_ids.add(id)
+        nodes.pop(id, None)  # may not be here if the ID is a root
+        closed_ids.add(id)
         request_failures += 1
         if request_failures > params.api_failure_limit:
             print(f"[ERROR] Too many failures of semanticscholar API (> {params.api_failure_limit})")
@@ -157,95 +206,121 @@ def smart_fetch(seeds: Set[PaperId],
         return False
 
 
+    # author similarity (hence disinterest) of a pair never changes,
+    # and the same edge is relaxed again whenever either endpoint is
+    # re-encountered; keyed on the unordered id pair
+    disinterest_cache = {}
+
+
     def edge_disinterest(src: Paper, dst: Paper) -> float:
         """ > 0"""
-        max_disinterest = 5
-        return 1 + max_disinterest * (1 - authors_similarity(src, dst))
+        key = (src.id, dst.id) if src.id < dst.id else (dst.id, src.id)
+        disinterest = disinterest_cache.get(key, None)
+        if disinterest is None:
+            max_disinterest = 5
+            disinterest = disinterest_cache[key] = \
+                1 + max_disinterest * (1 - authors_similarity(src, dst))
+        return disinterest
 
 
     def update_multimap(k, v):
-        if k in neighbors:
-            neighbors_of_k = neighbors[k]
-            if v not in neighbors_of_k:
-                neighbors_of_k.add(v)
-                return True
-            else:
-                return False
-        else:
+        neighbors_of_k = neighbors.get(k, None)
+        if neighbors_of_k is None:
             neighbors[k] = {v}
             return True
+        if v in neighbors_of_k:
+            return False
+        neighbors_of_k.add(v)
+        return True
 
 
     def add_ref(src, dst, is_influential):
         """Record that paper src cites paper dst."""
         if update_multimap(dst.id, src.id):
             if is_influential:
-                influential_edges.add((src.id, dst.id))
-            return update_multimap(src.id, dst.id)
+                influential_in.setdefault(dst.id, set()).add(src.id)
+                influential_out.setdefault(src.id, set()).add(dst.id)
+            added = update_multimap(src.id, dst.id)
+            # The new edge changes the degree (and influence bonus) of
+            # both endpoints, and the clustering of every node that
+            # neighbors both of them.
+            invalidate(src.id)
+            invalidate(dst.id)
+            src_nbs = neighbors.get(src.id, None)
+            dst_nbs = neighbors.get(dst.id, None)
+            if src_nbs and dst_nbs:
+                for common in src_nbs & dst_nbs:
+                    invalidate(common)
+            return added
         return False
 
 
     def a_priori_interest(p: Paper) -> float:
         """a-priori interest in the paper"""
         my_neighbors = neighbors.get(p.id, set())
-        neighbors_in_graph = graph_nodes.keys() & my_neighbors
+        neighbors_in_graph = my_neighbors & graph_node_ids
         num_new_edges = len(neighbors_in_graph)
 
-        clustering = params.clustering_factor * clusterness(neighbors_in_graph, neighbors)
-        base = min(num_new_edges, params.degree_cut) * (1 + clustering)
+        clustering = clustering_factor * clusterness(neighbors_in_graph, neighbors)
+        base = min(num_new_edges, degree_cut) * (1 + clustering)
 
-        influence_bonus = sum((+2 if (src in neighbors_in_graph and dst == p.id)
-                                   else +1 if (dst in neighbors_in_graph and src == p.id) else 0)
-                               for (src, dst) in influential_edges
-                               ) / (num_new_edges + 1)
-        # if influence_bonus != 0:
-        #     print(f"{influence_bonus} / {(num_new_edges + 1)} = {influence_bonus / (num_new_edges + 1)}")
+        # an influential citation from the graph counts double one
+        # towards it (the endpoints of such an edge are neighbors of p,
+        # so intersecting with neighbors_in_graph is intersecting with
+        # the graph)
+        influence_bonus = 0
+        srcs = influential_in.get(p.id, None)
+        if srcs:
+            influence_bonus += 2 * len(srcs & neighbors_in_graph)
+        dsts = influential_out.get(p.id, None)
+        if dsts:
+            influence_bonus += len(dsts & neighbors_in_graph)
 
-        base = base + influence_bonus
+        base = base + influence_bonus / (num_new_edges + 1)
 
         return base * 3 if p in biblio else base
 
 
-    def distance_from_focal(p: Paper):
-        return distance_to_root.get(p.id, 10)
-
-
     def degree_of_interest(p: Paper) -> float:
-        return params.api_weight * a_priori_interest(p) \
-               - params.distance_penalty * distance_from_focal(p)
+        # 10 is the distance assumed for nodes not yet reached
+        return api_weight * a_priori_interest(p) \
+               - distance_penalty * distance_to_root.get(p.id, 10)
 
 
     def update_distances(cur, neighbor):
+        # edge_disinterest is symmetric, one call serves both directions
+        weight = edge_disinterest(cur, neighbor)
+        cur_dist = distance_to_root.get(cur.id, Infty)
+        neighbor_dist = distance_to_root.get(neighbor.id, Infty)
+
         # Try to see if passing through the new neighbor is a better path from the root to 'cur'
-        best_dist = distance_to_root.get(cur.id, Infty)
-        tentative_dist = distance_to_root.get(neighbor.id, Infty) + edge_disinterest(neighbor, cur)
-        if tentative_dist < best_dist:
-            distance_to_root[cur.id] = tentative_dist
-            best_dist = tentative_dist
+        if neighbor_dist + weight < cur_dist:
+            cur_dist = distance_to_root[cur.id] = neighbor_dist + weight
+            invalidate(cur.id)
 
         # Similarly, try to see if passing through 'cur' is a better path from the root to the neighbor
-        tentative_dist = best_dist + edge_disinterest(cur, neighbor)
-        cur_dist = distance_to_root.get(neighbor.id, Infty)
-        if tentative_dist < cur_dist:
-            distance_to_root[neighbor.id] = tentative_dist
+        if cur_dist + weight < neighbor_dist:
+            distance_to_root[neighbor.id] = cur_dist + weight
+            invalidate(neighbor.id)
 
 
     def update_graph(cur):
 
         for (citing, is_influential) in sorted(cur.citations, key=lambda c: c.paper.id):
-            nodes[citing.id] = citing
+            discover(citing)
             if add_ref(citing, cur, is_influential) and params.consider_upward_links:
                 # only if we really added the ref
                 update_distances(citing, cur)
 
         for (cited, is_influential) in sorted(cur.references, key=lambda c: c.paper.id):
-            nodes[cited.id] = cited
+            discover(cited)
             if add_ref(cited, cur, is_influential):
                 # only if we really added the ref
                 update_distances(cur, cited)
 
 
-    # fetch the roots
+    # fetch the roots, in parallel to hide request latency
+    db.prefetch(seeds)
     roots = [resp for id in seeds for resp in [db.fetch_from_id(id)] if resp or not handle_api_failure(id, None)]
     roots = [r for r in roots if r]
     if len(roots) == 0:
@@ -254,27 +329,55 @@ def smart_fetch(seeds: Set[PaperId],
 
     # For node n, g_score[n] is the cost of the best path from start to n currently known.
     distance_to_root = {p.id: 0 for p in roots}
-    nodes = {**nodes, **{p.id: p for p in roots}}
+    for p in roots:
+        discover(p)
     # Nodes that are in the graph
     graph_nodes = {}
+    # live view, tracks graph_nodes; hoisted out of a_priori_interest
+    graph_node_ids = graph_nodes.keys()
 
     for r in roots:
         update_graph(r)
 
-    # todo dynamic programming
-    #  the DOI of a node doesn't change unless the node's neighbors have changed
     while True:
-        (best, cur_doi) = max([(n, degree_of_interest(n))
-                               for n in nodes.values()
-                               if n.id not in graph_nodes
-                               and n.id not in failed_ids],
-                              key=lambda t: t[1],
-                              default=(None, 0))
+        # Rescore the nodes whose DOI was invalidated since the last
+        # pick, and push fresh heap entries for them. Only the
+        # neighborhood of the last addition is dirty, not the whole
+        # frontier.
+        while dirty:
+            nid = dirty.pop()
+            if nid in closed_ids or nid not in nodes:
+                continue
+            doi = doi_cache[nid] = degree_of_interest(nodes[nid])
+            heapq.heappush(doi_heap, (-doi, node_rank[nid], nid))
+
+        # Pop stale entries (node already picked, failed, or rescored
+        # since the entry was pushed) until the top is the argmax.
+        best = None
+        cur_doi = 0
+        while doi_heap:
+            (neg_doi, _, nid) = doi_heap[0]
+            if (nid in closed_ids or nid not in nodes
+                    or doi_cache.get(nid, None) != -neg_doi):
+                heapq.heappop(doi_heap)
+                continue
+            (best, cur_doi) = (nodes[nid], -neg_doi)
+            break
+
         if not best:
             print("No more nodes to explore")
             break  # no more nodes
 
         pre_id = best.id
+        if not isinstance(best, PaperAndRefs):
+            # The next picks usually come from the current top of the
+            # heap, so fetch the few best unresolved candidates in one
+            # concurrent batch instead of one round-trip per pick.
+            top_candidates = heapq.nlargest(8, (
+                (doi, nid) for (nid, doi) in doi_cache.items()
+                if nid not in closed_ids
+                and nid in nodes and not isinstance(nodes[nid], PaperAndRefs)))
+            db.prefetch([nid for (_, nid) in top_candidates])
         result: Optional[PaperAndRefs] = db.fetch_from_id(best.id) if not isinstance(best, PaperAndRefs) else best
 
         if not result:
@@ -284,10 +387,14 @@ def smart_fetch(seeds: Set[PaperId],
 
         best = result
         graph_nodes[best.id] = best
+        closed_ids.add(best.id)
+        # entering the graph changes num_new_edges for every neighbor
+        for nid in neighbors.get(best.id, ()):
+            invalidate(nid)
         if pre_id != best.id:
             del nodes[pre_id]
-            if pre_id in graph_nodes:
-                del graph_nodes[pre_id]
+            doi_cache.pop(pre_id, None)
+            graph_nodes.pop(pre_id, None)
 
         print(f'[{len(graph_nodes)} / {params.max_graph_size} / {len(nodes)}] (DOI {cur_doi}) {best.title} ')
         if len(graph_nodes) >= params.max_graph_size:
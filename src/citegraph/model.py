@@ -1,17 +1,35 @@
 import re
+import sys
+from functools import lru_cache
 from typing import NewType, List, Dict, NamedTuple
 
 import pybtex.database as bibtex
-from pybtex.database.input.bibtex import Parser as BibParser
 
 SEMAPI_ID_FIELD = "semapi_id"
 ABSTRACT_FIELD = "_abstract"
 
+_PUNCT_RE = re.compile("[-:{}]")
+_WS_RE = re.compile("\\s{2,}")
+
 Person = bibtex.Person
 
 PaperId = NewType("PaperId", str)
 
 
+@lru_cache(maxsize=None)
+def person_from_api_name(name: str) -> Person:
+    """
+    Builds a Person from a plain "First Last" name, as returned
+    by the semanticscholar API. This sidesteps pybtex's name
+    grammar, which is by far the most expensive part of turning
+    an API response into Papers, and is overkill here: we only
+    ever use the last name. Cached: the same authors recur across
+    the papers of a crawl, and Persons are never mutated.
+    """
+    (first, _, last) = name.rpartition(" ")
+    return Person(first=first, last=last)
+
+
 class Paper(object):
 
     def __init__(self,
@@ -23,20 +41,28 @@ class Paper(object):
         self.fields = fields
         self.authors = authors
         self.type_ = type_
-        self.id = id or bibtex_id
-        self.bibtex_id = bibtex_id
+        # promoted to real attributes: these are read on every label,
+        # score and log line, and the __getattr__ fallback costs a
+        # Python call plus a dict lookup per access
+        self.title = fields.get("title", None)
+        self.year = fields.get("year", None)
+        # ids end up as keys of many dicts and sets (graph adjacency,
+        # caches, ...); interned strings hash once and compare by pointer
+        self.id = sys.intern(id) if id else (sys.intern(bibtex_id) if bibtex_id else None)
+        self.bibtex_id = sys.intern(bibtex_id) if bibtex_id else None
 
     def __getattr__(self, name):
         return self.fields.get(name, None)
 
     def __eq__(self, other):
-        if not isinstance(other, Paper):
-            return super(Paper, self).__eq__(other)
-        else:
-            return self.id and self.id == other.id or self.title == other.title
+        # id is the identity: every construction site provides either a
+        # semanticscholar id or a bibtex key. The old title fallback
+        # made equality inconsistent with the hash and compared long
+        # strings through __getattr__ on every set/dict probe.
+        return isinstance(other, Paper) and self.id == other.id
 
     def __hash__(self):
-        return hash(self.id) if self.id else hash(self.title)
+        return hash(self.id)
 
     def __str__(self):
         return f"{self.year} {self.title}"
@@ -69,10 +95,10 @@ class PaperAndRefs(Paper):
         return len(self.references)
 
     def __hash__(self):
-        return hash(id)
+        return hash(self.id)
 
     def __eq__(self, other):
-        return isinstance(other, Paper) and id == other.id
+        return isinstance(other, Paper) and self.id == other.id
 
 
 class Biblio(object):
@@ -80,21 +106,37 @@ class Biblio(object):
 
     def __init__(self, bibdata: bibtex.BibliographyData):
         self.bibdata = bibdata
-        self.by_norm_title: Dict[str, Paper] = {
-            self._normalize_title(paper.fields["title"])
-            : Paper(paper.fields,
-                    paper.persons["author"],
-                    id=paper.key,
-                    bibtex_id=paper.key)
-            for paper in bibdata.entries.values()
+        # Entries are materialized into Papers lazily, on first use.
+        # Most entries are only ever needed for the title index, so
+        # parsing persons etc. eagerly is wasted work on big bib files.
+        self.by_norm_title: Dict[str, str] = {
+            self._normalize_title(entry.fields["title"]): key
+            for (key, entry) in bibdata.entries.items()
         }
+        self._papers: Dict[str, Paper] = {}
+        # Key membership is tested once or twice per node and edge, so
+        # probe a plain frozenset instead of pybtex's case-insensitive
+        # dict, which lowercases through several Python calls per test.
+        self._bib_keys = frozenset(key.lower() for key in bibdata.entries)
         self.id_to_bibkey = {}
 
+    def _paper_from_key(self, key: str) -> Paper:
+        paper = self._papers.get(key, None)
+        if not paper:
+            entry = self.bibdata.entries[key]
+            paper = Paper(entry.fields,
+                          entry.persons["author"],
+                          id=key,
+                          bibtex_id=key)
+            self._papers[key] = paper
+        return paper
+
     @staticmethod
     def _normalize_title(title: str):
-        title = title.lower()
-        title = re.sub("[-:{}]", "", title)  # delete some punctuation
-        title = re.sub("\\s{2,}", " ", title)  # normalize whitespace
+        # casefold, not lower: matches titles containing eg ß/ss
+        title = title.casefold()
+        title = _PUNCT_RE.sub("", title)  # delete some punctuation
+        title = _WS_RE.sub(" ", title)  # normalize whitespace
         return title
 
     def __contains__(self, paper: Paper):
@@ -102,22 +144,58 @@ class Biblio(object):
         Returns whether this bib file contains the given entry.
         """
         return paper.id and paper.id in self.id_to_bibkey \
-            or paper.bibtex_id and paper.bibtex_id in self.bibdata.entries
+            or paper.bibtex_id and paper.bibtex_id.lower() in self._bib_keys
 
     def __iter__(self):
-        return iter(self.by_norm_title.values())
+        return (self._paper_from_key(key) for key in self.by_norm_title.values())
 
     def enrich(self, paper):
-        bibtex_entry = self.by_norm_title.get(self._normalize_title(paper.title), None)
-        if bibtex_entry:
-            paper.bibtex_id = bibtex_entry.bibtex_id
-            self.id_to_bibkey[paper.id] = bibtex_entry.bibtex_id
+        bibkey = self.by_norm_title.get(self._normalize_title(paper.title), None)
+        if bibkey:
+            paper.bibtex_id = bibkey
+            self.id_to_bibkey[paper.id] = bibkey
         return paper
 
     @staticmethod
     def from_file(filename) -> 'Biblio':
+        from pybtex.database.input.bibtex import Parser as BibParser
         return Biblio(BibParser().parse_file(filename))
 
+    @staticmethod
+    def from_file_cached(filename) -> 'Biblio':
+        """
+        Like from_file, but caches the parse result on disk, keyed on
+        the file's size and mtime. Parsing a big bib file easily
+        dominates startup, unpickling is much cheaper.
+        """
+        import hashlib
+        import os
+        import pickle
+        from pathlib import Path
+
+        st = os.stat(filename)
+        # v2: bump when the pickled layout (eg title normalization)
+        # changes, so stale caches are reparsed instead of mismatching
+        key = hashlib.md5(
+            f"v2:{os.path.abspath(filename)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()
+        cache_file = Path.home() / ".cache" / "citegraph" / f"{key}.pkl"
+
+        if cache_file.is_file():
+            try:
+                with cache_file.open("rb") as f:
+                    return pickle.load(f)
+            except Exception:
+                pass  # stale or corrupt cache, reparse
+
+        biblio = Biblio.from_file(filename)
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with cache_file.open("wb") as f:
+                pickle.dump(biblio, f)
+        except OSError:
+            pass  # caching is best-effort
+        return biblio
+
     @staticmethod
     def empty() -> 'Biblio':
         return Biblio(bibtex.BibliographyData())
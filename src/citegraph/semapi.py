@@ -1,4 +1,7 @@
 import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional, List, Iterable
 
 from semanticscholar import SemanticScholar as ScholarApi
@@ -53,9 +56,18 @@ class PaperDb(object):
         self.dbconn = None
         self.memcache = {}
         self.idcache: Dict[str, int] = {}  # external -> internal id
+        # plain (ref-less) Papers by internal id: the same cited paper
+        # shows up in the reference lists of many fetched papers, no
+        # point rebuilding it from its rows every time
+        self.papercache: Dict[int, Paper] = {}
         self.api = ScholarApi()
 
     def __paper_from_db(self, internal_id: int, with_refs: bool) -> PaperAndRefs:
+        if not with_refs:
+            cached = self.papercache.get(internal_id, None)
+            if cached is not None:
+                return cached
+
         c = self.dbconn.cursor()
         c.execute("SELECT title, year, originalId FROM Papers WHERE id=?", (internal_id,))
         found = c.fetchone()
@@ -69,7 +81,9 @@ class PaperDb(object):
                       authors=self.__authors_from_db(internal_id))
 
         if not with_refs:
-            return self.bibdata.enrich(paper)
+            paper = self.bibdata.enrich(paper)
+            self.papercache[internal_id] = paper
+            return paper
 
         citations = [Citation(self.__paper_from_db(id[0], False), bool(id[1]))
                      for id in c.execute(f"SELECT src, influential FROM Citations WHERE dst=?",
@@ -95,24 +109,38 @@ class PaperDb(object):
         self.cursor.execute("SELECT id FROM Resolved WHERE id=?", (internal_id,))
         return bool(self.cursor.fetchone())
 
+    # forget "scholar doesn't know this id" verdicts after 30 days
+    MISS_TTL_SECONDS = 30 * 24 * 3600
+
+    def __is_known_missing(self, paper_id: PaperId) -> bool:
+        self.cursor.execute("SELECT ts FROM Misses WHERE id=?", (paper_id,))
+        found = self.cursor.fetchone()
+        return bool(found) and time.time() - found[0] < PaperDb.MISS_TTL_SECONDS
+
+    def __record_miss(self, paper_id: PaperId):
+        self.cursor.execute("REPLACE INTO Misses VALUES (?,?)", (paper_id, int(time.time())))
+        self.dbconn.commit()
+
     def __authors_from_db(self, internal_id: int) -> List[Person]:
-        return [Person(tup[0]) for tup in _tupled_sort(self.dbconn.execute(
+        return [person_from_api_name(tup[0]) for tup in _tupled_sort(self.dbconn.execute(
             "SELECT Authors.name, AuthorLinks.rank FROM Authors INNER JOIN AuthorLinks ON AuthorLinks.authorId = Authors.id WHERE AuthorLinks.paperId=?",
             (internal_id,)))]
 
     def __update_db(self, response: ApiPaper) -> PaperAndRefs:
 
         authors = {}
-        authorship = set([])
+        authorship = set()
         cites = []
         papers = []
 
         # todo handle missing authorId
 
+        internalize = self._internalize_id
+
         def paper_update(paper: ApiPaper):
             id_ = paper.paperId
             papers.append(
-                (self._internalize_id(id_), id_, paper.title or "", int(paper.year or 0)))
+                (internalize(id_), id_, paper.title or "", int(paper.year or 0)))
 
         def author_update(paper: ApiPaper, paper_id):
             for i, author in enumerate(paper["authors"]):
@@ -120,7 +148,7 @@ class PaperDb(object):
                 authors[author_id] = author["name"]
                 authorship.add((paper_id, author_id, i))
 
-        internal_id = self._internalize_id(response.paperId)
+        internal_id = internalize(response.paperId)
         paper_update(response)
         author_update(response, internal_id)
 
@@ -128,7 +156,7 @@ class PaperDb(object):
             for ref in papers:
                 if not ref.paperId:
                     continue
-                ref_id = self._internalize_id(ref.paperId)
+                ref_id = internalize(ref.paperId)
                 is_influential = ref.influentialCitationCount > 1  # todo fix that, used to be a field "is_influential"
                 if is_references:
                     cites.append((internal_id, ref_id, is_influential))
@@ -140,6 +168,10 @@ class PaperDb(object):
         cite_update(response.references, True)
         cite_update(response.citations, False)
 
+        # the REPLACE may update rows cached as Paper objects
+        for row in papers:
+            self.papercache.pop(row[0], None)
+
         self.cursor.executemany("REPLACE INTO Papers VALUES (?,?,?,?)", papers)
         self.cursor.executemany("REPLACE INTO Citations VALUES (?,?,?)", cites)
         self.cursor.executemany("REPLACE INTO Authors VALUES (?,?)", authors.items())
@@ -162,25 +194,76 @@ class PaperDb(object):
 
         found = self.__paper_from_db_wrapper(paper_id, True)
         if found:
+            self.memcache[paper_id] = found
             return found
 
+        # known-missing ids fail again on every cold run otherwise,
+        # wasting a request and eating into the failure budget
+        if self.__is_known_missing(paper_id):
+            self.memcache[paper_id] = None
+            return None
+
         try:
             paper: ApiPaper = self.api.get_paper(paper_id)
             error = len(paper.keys()) == 0
+            if error:
+                self.__record_miss(paper_id)
         except requests.exceptions.RequestException as e:
+            # transient: don't record a miss
             print(f"[ERROR] {str(e)}")
             error = True
 
         if error:
             result = None
         else:
+            self.cursor.execute("DELETE FROM Misses WHERE id=?", (paper_id,))
             result = self.__update_db(response=paper)
-            result.id = PaperId(paper.paperId)
+            result.id = PaperId(sys.intern(paper.paperId))
             result = result
 
         self.memcache[paper_id] = result
         return result
 
+    def prefetch(self, paper_ids: Iterable[PaperId], max_workers: int = 8):
+        """
+        Fetches the given papers concurrently and caches the results,
+        so that later fetch_from_id calls don't block on the network.
+        HTTP requests run on a thread pool, but the sqlite writes stay
+        on the calling thread (sqlite connections are thread-bound).
+        """
+        todo = []
+        for id in paper_ids:
+            if id in self.memcache:
+                continue
+            found = self.__paper_from_db_wrapper(id, True)
+            if found:
+                # keep the built record instead of discarding it: the
+                # caller is about to fetch_from_id these very ids
+                self.memcache[id] = found
+            elif not self.__is_known_missing(id):
+                todo.append(id)
+        if not todo:
+            return
+
+        def fetch(paper_id):
+            try:
+                return paper_id, self.api.get_paper(paper_id)
+            except requests.exceptions.RequestException as e:
+                print(f"[ERROR] {str(e)}")
+                return paper_id, None
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(todo))) as pool:
+            for (paper_id, paper) in pool.map(fetch, todo):
+                if paper is None:  # transient error, don't record a miss
+                    self.memcache[paper_id] = None
+                elif len(paper.keys()) == 0:
+                    self.__record_miss(paper_id)
+                    self.memcache[paper_id] = None
+                else:
+                    result = self.__update_db(response=paper)
+                    result.id = PaperId(sys.intern(paper.paperId))
+                    self.memcache[paper_id] = result
+
     def _internalize_id(self, id: str) -> int:
         # Turn a 40 digit hex ID (160 bits) into a 32 bit int
         # This is a big deal to make the DB smaller
@@ -204,6 +287,12 @@ class PaperDb(object):
         self.dbconn = sqlite3.connect(self.dbfile)
         self.cursor = self.dbconn.cursor()
 
+        # The db is a cache: losing the last write on a crash only
+        # costs a re-fetch, so trade the per-commit fsync for write
+        # speed. WAL also lets reads proceed while a response commits.
+        self.cursor.execute("PRAGMA journal_mode=WAL;")
+        self.cursor.execute("PRAGMA synchronous=NORMAL;")
+
         self.cursor.execute(
             "CREATE TABLE IF NOT EXISTS Papers (id INTEGER PRIMARY KEY, originalId VARCHAR, title VARCHAR, year INTEGER);")
         self.cursor.execute("""
@@ -216,6 +305,14 @@ class PaperDb(object):
                                    FOREIGN KEY (dst) REFERENCES Papers(id),
                                    PRIMARY KEY (src, dst));
         """)
+        # The (src, dst) primary key only speeds up lookups by src,
+        # fetching the citations of a cached paper scans the whole table
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS CitationsByDst ON Citations (dst);")
+        # ids the API reported as unknown, so they aren't retried on
+        # every run (keyed on the external id, which may not be 40-hex)
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS Misses (id VARCHAR PRIMARY KEY, ts INTEGER);")
         self.cursor.execute(
             "CREATE TABLE IF NOT EXISTS Authors (id INTEGER PRIMARY KEY, name VARCHAR);")
         self.cursor.execute("""